@@ -1,156 +1,355 @@
 import streamlit as st
-import os
 import re
 from datetime import datetime
-from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 import io
-import docx
-import email
+import zipfile
+from lxml import etree
 from email import policy
+from email.parser import BytesParser
+from selectolax.lexbor import LexborHTMLParser
+from gemini_requests import BackgroundStream, TruncatedResponse, astream_text, content_hash, run_streams, stream_text
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Analysis is a fixed-format summary that the lighter model handles well;
+# reply drafting keeps the full flash model
+ANALYSIS_MODEL = "gemini-2.5-flash-lite"
+REPLY_MODEL = "gemini-2.5-flash"
 
-def analyze_email(email_content):
+# Static instructions are sent as system instructions, so every request starts with
+# the same prefix and Gemini's implicit caching can reuse it. They are far below the
+# minimum size for an explicit context cache.
+ANALYSIS_INSTRUCTIONS = """
+Analyze the email you are given and provide analysis in both English and Telugu languages.
+
+Please provide the analysis in this exact format:
+
+## English Analysis
+**Summary:** [brief summary in English, 2-3 sentences]
+**Intent:** [sender's intent/purpose in English]
+**Key Points:** [bullet points in English]
+**Urgency:** [Low/Medium/High]
+
+## Telugu Analysis / తెలుగు విశ్లేషణ
+**సారాంశం:** [brief summary in Telugu, 2-3 sentences]
+**ఉద్దేశ్యం:** [sender's intent/purpose in Telugu]
+**ముఖ్య అంశాలు:** [bullet points in Telugu]
+**అత్యవసరత:** [తక్కువ/మధ్యమ/అధిక]
+"""
+
+REPLY_INSTRUCTIONS = """
+Write a professional email reply to the email you are given, following the TONE,
+LENGTH and any SPECIFIC ACTION stated below.
+
+Generate a complete email reply with:
+- Appropriate subject line (if needed)
+- Professional greeting
+- Main body addressing the sender's points
+- Appropriate closing
+
+Do not include sender's signature - that will be added separately.
+"""
+
+# Define tone characteristics
+TONE_INSTRUCTIONS = {
+    "professional": "Use formal business language, be respectful and direct",
+    "friendly": "Use warm, approachable language while maintaining professionalism",
+    "casual": "Use relaxed, conversational tone but still appropriate for business",
+    "formal": "Use very formal, traditional business language with proper etiquette",
+    "empathetic": "Show understanding and compassion, acknowledge concerns warmly",
+    "assertive": "Be confident and clear, take charge of the situation"
+}
+
+# Define length guidelines
+LENGTH_INSTRUCTIONS = {
+    "short": "Keep the reply to 2-3 sentences maximum, be very concise",
+    "medium": "Write a balanced reply of 1-2 paragraphs",
+    "detailed": "Provide a comprehensive response with detailed explanations"
+}
+
+# Quick action prompts
+ACTION_PROMPTS = {
+    "accept_meeting": "Accept the meeting invitation graciously and confirm availability",
+    "decline_politely": "Politely decline the request with a brief explanation",
+    "request_info": "Ask for additional information or clarification professionally",
+    "acknowledge": "Acknowledge receipt and provide appropriate response",
+    "schedule_followup": "Suggest scheduling a follow-up meeting or call"
+}
+
+# Output token budget per reply length; the longest a reply of that length should need
+LENGTH_CAPS = {
+    "short": 120,
+    "medium": 350,
+    "detailed": 800
+}
+
+def _reply_system_instruction(tone, length, action_type):
+    """Full reply system instruction for one tone, length and quick action"""
+    instruction = f"{REPLY_INSTRUCTIONS}\nTONE: {TONE_INSTRUCTIONS[tone]}\nLENGTH: {LENGTH_INSTRUCTIONS[length]}\n"
+    if action_type:
+        instruction += f"SPECIFIC ACTION: {ACTION_PROMPTS[action_type]}\n"
+    return instruction
+
+# Every tone x length x action combination, built once at import. Each is a
+# fixed system instruction, so each is a stable prefix for implicit caching.
+REPLY_SYSTEM_INSTRUCTIONS = {
+    (tone, length, action_type): _reply_system_instruction(tone, length, action_type)
+    for tone in TONE_INSTRUCTIONS
+    for length in LENGTH_INSTRUCTIONS
+    for action_type in (None, *ACTION_PROMPTS)
+}
+
+# Neither task benefits from chain-of-thought, which only delays the first token
+NO_THINKING = types.ThinkingConfig(thinking_budget=0)
+
+def _last(stream):
+    """Drain a text stream and return its final accumulated value"""
+    text = ""
+    for text in stream:
+        pass
+    return text
+
+# Start of quoted history ("On ... wrote:", "-----Original Message-----") or of the
+# sender's signature; everything from the first match on is dropped. Only the exact
+# "-- " delimiter line counts as a signature: a bare "--" is often part of the body.
+QUOTE_CUTOFF_RE = re.compile(
+    r"^(?:[ \t]*(?:On .+ wrote:|(?i:-{2,}[ \t]*Original Message[ \t]*-{2,}))[ \t]*|-- )$",
+    re.M
+)
+# Inline '>' quoted lines, including their line break. Whitespace is matched with
+# [ \t] so a match never reaches back over the blank lines between paragraphs.
+QUOTED_LINE_RE = re.compile(r"^[ \t]*>[^\n]*(?:\n|$)", re.M)
+
+def strip_quoted_text(email_content):
     """
-    Analyze incoming email to understand context and intent in both English and Telugu
+    Drop quoted reply history and the sender's signature, which only inflate
+    the prompt. Returns the original text when nothing else is left.
     """
-    try:
-        prompt = f"""
-        Analyze the following email and provide analysis in both English and Telugu languages:
-        
-        Email content:
-        {email_content}
-        
-        Please provide the analysis in this exact format:
-        
-        ## English Analysis
-        **Summary:** [brief summary in English, 2-3 sentences]
-        **Intent:** [sender's intent/purpose in English]
-        **Key Points:** [bullet points in English]
-        **Urgency:** [Low/Medium/High]
-        
-        ## Telugu Analysis / తెలుగు విశ్లేషణ
-        **సారాంశం:** [brief summary in Telugu, 2-3 sentences]
-        **ఉద్దేశ్యం:** [sender's intent/purpose in Telugu]
-        **ముఖ్య అంశాలు:** [bullet points in Telugu]
-        **అత్యవసరత:** [తక్కువ/మధ్యమ/అధిక]
-        """
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        
-        return response.text if response.text else "Unable to analyze email."
-    except Exception as e:
-        return f"Error analyzing email: {str(e)}"
+    cutoff = QUOTE_CUTOFF_RE.search(email_content)
+    new_content = email_content[:cutoff.start()] if cutoff else email_content
+    new_content = QUOTED_LINE_RE.sub("", new_content).strip()
+    return new_content or email_content
 
-def generate_email_reply(email_content, tone="professional", length="medium", action_type=None, custom_signature=""):
+def _build_analysis_prompt(email_content):
+    """Build the variable part of the analysis prompt for an email"""
+    return f"""
+    Email content:
+    {strip_quoted_text(email_content)}
     """
-    Generate AI-powered email reply with specified tone and length
+
+def analyze_email(email_content, stream=False):
     """
-    try:
-        # Define tone characteristics
-        tone_instructions = {
-            "professional": "Use formal business language, be respectful and direct",
-            "friendly": "Use warm, approachable language while maintaining professionalism",
-            "casual": "Use relaxed, conversational tone but still appropriate for business",
-            "formal": "Use very formal, traditional business language with proper etiquette",
-            "empathetic": "Show understanding and compassion, acknowledge concerns warmly",
-            "assertive": "Be confident and clear, take charge of the situation"
-        }
-        
-        # Define length guidelines
-        length_instructions = {
-            "short": "Keep the reply to 2-3 sentences maximum, be very concise",
-            "medium": "Write a balanced reply of 1-2 paragraphs",
-            "detailed": "Provide a comprehensive response with detailed explanations"
-        }
-        
-        # Quick action prompts
-        action_prompts = {
-            "accept_meeting": "Accept the meeting invitation graciously and confirm availability",
-            "decline_politely": "Politely decline the request with a brief explanation",
-            "request_info": "Ask for additional information or clarification professionally",
-            "acknowledge": "Acknowledge receipt and provide appropriate response",
-            "schedule_followup": "Suggest scheduling a follow-up meeting or call"
-        }
-        
-        base_prompt = f"""
-        Write a professional email reply to the following email. 
-        
-        TONE: {tone_instructions.get(tone, tone_instructions['professional'])}
-        LENGTH: {length_instructions.get(length, length_instructions['medium'])}
-        """
-        
-        if action_type and action_type in action_prompts:
-            base_prompt += f"\nSPECIFIC ACTION: {action_prompts[action_type]}"
-        
-        base_prompt += f"""
-        
-        Original email to reply to:
-        {email_content}
-        
-        Generate a complete email reply with:
-        - Appropriate subject line (if needed)
-        - Professional greeting
-        - Main body addressing the sender's points
-        - Appropriate closing
-        
-        Do not include sender's signature - that will be added separately.
-        """
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=base_prompt
-        )
-        
-        reply_text = response.text if response.text else "Unable to generate reply."
-        
+    Analyze incoming email to understand context and intent in both English and Telugu.
+    With stream=True, returns a generator yielding the analysis as it is produced.
+    Gemini errors are raised once retries are exhausted.
+    """
+    prompt = _build_analysis_prompt(email_content)
+    config = types.GenerateContentConfig(system_instruction=ANALYSIS_INSTRUCTIONS, thinking_config=NO_THINKING)
+    chunks = stream_text(ANALYSIS_MODEL, prompt, config, "Unable to analyze email.")
+    return chunks if stream else _last(chunks)
+
+def _build_reply_prompt(email_content):
+    """Build the variable part of the reply prompt"""
+    return f"Original email to reply to:\n{strip_quoted_text(email_content)}"
+
+def _reply_config(tone, length, action_type, temperature):
+    """
+    Generation config for a reply draft. Tone, length and quick action select the
+    system instruction; temperature varies the drafts without changing the prompt.
+    """
+    if tone not in TONE_INSTRUCTIONS:
+        tone = "professional"
+    if length not in LENGTH_INSTRUCTIONS:
+        length = "medium"
+    if action_type not in ACTION_PROMPTS:
+        action_type = None
+    return types.GenerateContentConfig(
+        system_instruction=REPLY_SYSTEM_INSTRUCTIONS[(tone, length, action_type)],
+        temperature=0.4 if temperature is None else temperature,
+        max_output_tokens=LENGTH_CAPS[length],
+        thinking_config=NO_THINKING
+    )
+
+def generate_email_reply(email_content, tone="professional", length="medium", action_type=None, custom_signature="", stream=False, temperature=None, use_cache=True):
+    """
+    Generate AI-powered email reply with specified tone and length.
+    With stream=True, returns a generator yielding the reply as it is produced.
+    With use_cache=False, a new reply is drafted even if one is cached.
+    Gemini errors are raised once retries are exhausted, and a reply cut off by
+    the length cap as TruncatedResponse.
+    """
+    prompt = _build_reply_prompt(email_content)
+    config = _reply_config(tone, length, action_type, temperature)
+    chunks = stream_text(REPLY_MODEL, prompt, config, "Unable to generate reply.", use_cache)
+    
+    def signed():
+        reply_text = ""
+        try:
+            for reply_text in chunks:
+                yield reply_text
+        except TruncatedResponse as e:
+            # A cut-off reply is still shown as a draft, so it gets the signature too
+            if custom_signature.strip():
+                raise TruncatedResponse(f"{e.text}\n\n{custom_signature}") from e
+            raise
         # Add custom signature if provided
         if custom_signature.strip():
-            reply_text += f"\n\n{custom_signature}"
-        
-        return reply_text
-    except Exception as e:
-        return f"Error generating reply: {str(e)}"
+            yield f"{reply_text}\n\n{custom_signature}"
+    
+    return signed() if stream else _last(signed())
 
-def extract_text_from_docx(file_bytes):
-    """Extract text from DOCX file"""
+async def generate_email_reply_async(email_content, tone="professional", length="medium", action_type=None, custom_signature="", temperature=None, use_cache=True):
+    """
+    Stream an email reply asynchronously, yielding the accumulated text after each chunk
+    """
+    prompt = _build_reply_prompt(email_content)
+    config = _reply_config(tone, length, action_type, temperature)
+    reply_text = ""
     try:
-        doc = docx.Document(io.BytesIO(file_bytes))
+        async for reply_text in astream_text(REPLY_MODEL, prompt, config, "Unable to generate reply.", use_cache):
+            yield reply_text
+    except TruncatedResponse as e:
+        # A cut-off reply is still shown as a draft, so it gets the signature too
+        if custom_signature.strip():
+            raise TruncatedResponse(f"{e.text}\n\n{custom_signature}") from e
+        raise
+    # Add custom signature if provided
+    if custom_signature.strip():
+        yield f"{reply_text}\n\n{custom_signature}"
+
+def _stream_into(streams, placeholders):
+    """
+    Consume several text streams concurrently, rendering each into its own placeholder.
+    A failed stream's exception is returned in place of its text.
+    """
+    return run_streams(streams, lambda i, text: placeholders[i].markdown(text))
+
+TRUNCATED_DRAFT_WARNING = "⚠️ This draft hit the length limit and was cut off. Generate new drafts or pick a longer reply length."
+
+def _request_new_drafts(action_type):
+    """Button callback: have the next run draft new replies with the same quick action"""
+    st.session_state.regenerate_action = action_type
+    # Otherwise this session's copy of the drafts, and the text areas showing
+    # them, would keep the old text
+    st.session_state.pop("drafts_key", None)
+    st.session_state.pop("drafts", None)
+    for key in [key for key in st.session_state if key.startswith("draft_")]:
+        del st.session_state[key]
+
+def _analysis_failed(placeholder, error):
+    """Report a failed analysis; clearing the job lets the next rerun start a fresh one"""
+    placeholder.error(f"Error analyzing email: {error}")
+    st.session_state.pop("analysis_job_hash", None)
+
+# Body paragraphs of word/document.xml and the run content within each one,
+# evaluated by libxml2 rather than through python-docx objects. The run content
+# is the same set python-docx's paragraph.text reads.
+WORD_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+WORD_NAMESPACES = {'w': WORD_NAMESPACE}
+DOCX_PARAGRAPHS = etree.XPath('/w:document/w:body/w:p', namespaces=WORD_NAMESPACES)
+DOCX_RUN_CONTENT = etree.XPath(
+    '(w:r | w:hyperlink/w:r)/*[self::w:t or self::w:tab or self::w:ptab'
+    ' or self::w:br or self::w:cr or self::w:noBreakHyphen]',
+    namespaces=WORD_NAMESPACES
+)
+W_T = f'{{{WORD_NAMESPACE}}}t'
+W_BR = f'{{{WORD_NAMESPACE}}}br'
+W_BR_TYPE = f'{{{WORD_NAMESPACE}}}type'
+DOCX_RUN_CONTENT_TEXT = {
+    f'{{{WORD_NAMESPACE}}}tab': '\t',
+    f'{{{WORD_NAMESPACE}}}ptab': '\t',
+    f'{{{WORD_NAMESPACE}}}cr': '\n',
+    W_BR: '\n',
+    f'{{{WORD_NAMESPACE}}}noBreakHyphen': '-'
+}
+# Uploads are untrusted: never expand entities or fetch anything while parsing
+DOCX_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+def _docx_run_content_text(element):
+    """Text equivalent of one run content element"""
+    if element.tag == W_T:
+        return element.text or ''
+    # Page and column breaks have no plain-text equivalent
+    if element.tag == W_BR and element.get(W_BR_TYPE, 'textWrapping') != 'textWrapping':
+        return ''
+    return DOCX_RUN_CONTENT_TEXT[element.tag]
+
+def extract_text_from_docx(file_obj):
+    """Extract text from a DOCX file object"""
+    try:
+        with zipfile.ZipFile(file_obj) as archive:
+            with archive.open('word/document.xml') as document_xml:
+                tree = etree.parse(document_xml, DOCX_XML_PARSER)
         text = []
-        for paragraph in doc.paragraphs:
-            text.append(paragraph.text)
+        for paragraph in DOCX_PARAGRAPHS(tree):
+            text.append(''.join(_docx_run_content_text(e) for e in DOCX_RUN_CONTENT(paragraph)))
         return '\n'.join(text)
     except Exception as e:
         return f"Error reading DOCX file: {str(e)}"
 
-def extract_text_from_eml(file_bytes):
-    """Extract text from EML file"""
+def _reply_attribution(blockquote):
+    """The "On ... wrote:" element right before a blockquote, or None if it has none"""
+    previous = blockquote.prev
+    while previous is not None and previous.tag == '-text' and not previous.text(strip=True):
+        previous = previous.prev
+    if previous is not None and QUOTE_CUTOFF_RE.fullmatch(previous.text(strip=True)):
+        return previous
+    return None
+
+def _drop_quoted_reply(tree):
+    """Remove one quoted reply from the tree; returns False when there is none left"""
+    for blockquote in tree.css('blockquote'):
+        attribution = _reply_attribution(blockquote)
+        if attribution is None and 'gmail_quote' not in (blockquote.attributes.get('class') or '').split():
+            continue
+        # Document order puts outer quotes first, so nested ones go with them
+        if attribution is not None:
+            attribution.decompose()
+        blockquote.decompose()
+        return True
+    return False
+
+def html_to_text(html):
+    """Extract readable text from an HTML email body, without quoted reply history"""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(['script', 'style'])
+    text = tree.text(separator=' ', strip=True)
+    # The text comes out on one line, where strip_quoted_text can't find the quote.
+    # A reply's quote is a blockquote right after its "On ... wrote:" attribution
+    # (Gmail's .gmail_attr, Thunderbird's .moz-cite-prefix) or Gmail's own
+    # blockquote.gmail_quote. Other blockquotes, like Apple Mail forwards, are kept.
+    while _drop_quoted_reply(tree):
+        pass
+    return tree.text(separator=' ', strip=True) or text
+
+def _part_text(part):
+    """Decode a text MIME part once, using the charset it declares"""
+    if part.get_content_maintype() != 'text':
+        return ""
     try:
-        msg = email.message_from_bytes(file_bytes, policy=policy.default)
+        return part.get_content()
+    except LookupError:
+        # Unknown charset label; decode leniently rather than failing the whole upload
+        return part.get_payload(decode=True).decode('utf-8', errors='replace')
+
+def extract_text_from_eml(file_obj):
+    """Extract text from an EML file object"""
+    try:
+        msg = BytesParser(policy=policy.default).parse(file_obj)
         
         # Get email metadata
         subject = msg.get('Subject', 'No Subject')
         sender = msg.get('From', 'Unknown Sender')
         date = msg.get('Date', 'No Date')
         
-        # Extract body
-        body = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    break
-        else:
-            body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
+        # Extract body, preferring plain text and falling back to HTML
+        body_part = msg.get_body(preferencelist=('plain', 'html')) or msg
+        body = _part_text(body_part)
+        if body_part.get_content_subtype() == 'html':
+            body = html_to_text(body)
         
         formatted_email = f"From: {sender}\nSubject: {subject}\nDate: {date}\n\n{body}"
         return formatted_email
@@ -236,14 +435,15 @@ def main():
             )
             
             if uploaded_file is not None:
-                file_bytes = uploaded_file.read()
-                
+                # Parsers read straight from the upload; getvalue() reuses its buffer
+                # for plain text instead of copying the file out first
+                uploaded_file.seek(0)
                 if uploaded_file.type == "text/plain":
-                    email_content = str(file_bytes, 'utf-8')
+                    email_content = uploaded_file.getvalue().decode('utf-8')
                 elif uploaded_file.name.endswith('.eml'):
-                    email_content = extract_text_from_eml(file_bytes)
+                    email_content = extract_text_from_eml(uploaded_file)
                 elif uploaded_file.name.endswith('.docx'):
-                    email_content = extract_text_from_docx(file_bytes)
+                    email_content = extract_text_from_docx(uploaded_file)
                 
                 if email_content:
                     st.success(f"✅ File '{uploaded_file.name}' loaded successfully!")
@@ -254,11 +454,25 @@ def main():
         st.header("🔍 Email Analysis")
         
         if email_content.strip():
-            with st.spinner("Analyzing email..."):
-                analysis = analyze_email(email_content)
-            
             st.markdown("### 📊 Analysis Results")
-            st.markdown(analysis)
+            # Reruns triggered by other widgets reuse this session's analysis of the same email.
+            # Otherwise the analysis starts in the background right away and is followed below,
+            # after the action buttons are on screen.
+            email_hash = content_hash(email_content)
+            analysis = None
+            if st.session_state.get("analysis_hash") == email_hash:
+                analysis = st.session_state.analysis
+            elif st.session_state.get("analysis_job_hash") != email_hash:
+                # The email changed, so the previous analysis is no longer wanted
+                if "analysis_job" in st.session_state:
+                    st.session_state.analysis_job.cancel()
+                st.session_state.analysis_job_hash = email_hash
+                st.session_state.analysis_job = BackgroundStream(analyze_email(email_content, stream=True))
+            analysis_placeholder = st.empty()
+            if analysis is None:
+                analysis_placeholder.info("Analyzing email...")
+            else:
+                analysis_placeholder.markdown(analysis)
         else:
             st.info("👆 Paste or upload an email to see analysis")
     
@@ -302,40 +516,110 @@ def main():
             action_type = "schedule_followup"
             generate_button = True
         
+        # "Generate New Drafts" reruns with the previous quick action and asks
+        # Gemini for new samples instead of the cached drafts
+        regenerate = "regenerate_action" in st.session_state
+        if regenerate:
+            action_type = st.session_state.pop("regenerate_action")
+            generate_button = True
+        
         # Generate and display replies
-        if generate_button:
+        if not generate_button:
+            if analysis is None:
+                try:
+                    for analysis in st.session_state.analysis_job.follow():
+                        analysis_placeholder.markdown(analysis)
+                except Exception as e:
+                    _analysis_failed(analysis_placeholder, e)
+                else:
+                    st.session_state.analysis_hash = email_hash
+                    st.session_state.analysis = analysis
+        else:
             st.markdown("---")
             st.header("📝 Generated Reply Drafts")
             
-            # Generate multiple drafts
-            drafts = []
-            with st.spinner(f"Generating {num_drafts} reply draft(s)..."):
+            # Create one placeholder per draft so replies stream in as they are generated
+            placeholders = []
+            if num_drafts == 1:
+                st.subheader("📄 Reply Draft")
+                placeholders.append(st.empty())
+            else:
+                # Create tabs for multiple drafts
+                tab_names = [f"📄 Draft {i+1}" for i in range(num_drafts)]
+                tabs = st.tabs(tab_names)
+                for tab in tabs:
+                    with tab:
+                        placeholders.append(st.empty())
+            
+            # Generate multiple drafts concurrently, together with the email analysis
+            # unless this session already has them for the same inputs.
+            # Drafts share one prompt and vary by temperature instead.
+            streams = []
+            stream_placeholders = []
+            if analysis is None:
+                streams.append(st.session_state.analysis_job.afollow())
+                stream_placeholders.append(analysis_placeholder)
+            
+            drafts_key = (email_hash, tone, length, action_type, num_drafts, custom_signature)
+            drafts = None
+            if st.session_state.get("drafts_key") == drafts_key:
+                drafts = list(st.session_state.drafts)
+            else:
                 for i in range(num_drafts):
-                    # Add slight variation for multiple drafts
-                    variation_prompt = f" (Draft {i+1} variation)" if num_drafts > 1 else ""
-                    reply = generate_email_reply(
-                        email_content + variation_prompt, 
+                    streams.append(generate_email_reply_async(
+                        email_content, 
                         tone, 
                         length, 
                         action_type, 
-                        custom_signature
-                    )
-                    drafts.append(reply)
+                        custom_signature,
+                        temperature=0.3 + 0.2 * i,
+                        use_cache=not regenerate
+                    ))
+                stream_placeholders.extend(placeholders)
+            
+            results = _stream_into(streams, stream_placeholders)
+            if analysis is None:
+                analysis = results.pop(0)
+                if isinstance(analysis, Exception):
+                    _analysis_failed(analysis_placeholder, analysis)
+                else:
+                    st.session_state.analysis_hash = email_hash
+                    st.session_state.analysis = analysis
+            truncated = [False] * num_drafts
+            if drafts is None:
+                # Failed drafts are reported in place and left out of the session,
+                # so the next attempt retries them instead of replaying the error.
+                # Cut-off drafts are shown, flagged, but also left out.
+                drafts = []
+                for i, (placeholder, result) in enumerate(zip(placeholders, results)):
+                    if isinstance(result, TruncatedResponse):
+                        truncated[i] = True
+                        drafts.append(result.text)
+                    elif isinstance(result, Exception):
+                        placeholder.error(f"Error generating reply: {result}")
+                        drafts.append(None)
+                    else:
+                        drafts.append(result)
+                if None not in drafts and not any(truncated):
+                    st.session_state.drafts_key = drafts_key
+                    st.session_state.drafts = list(drafts)
             
             # Display drafts in tabs or columns
             if num_drafts == 1:
-                st.subheader("📄 Reply Draft")
-                st.text_area("Generated Reply:", drafts[0], height=300, key="draft_1")
-                st.button(f"📋 Copy Draft to Clipboard", key="copy_1")
+                if drafts[0] is not None:
+                    placeholders[0].text_area("Generated Reply:", drafts[0], height=300, key="draft_1")
+                    if truncated[0]:
+                        st.warning(TRUNCATED_DRAFT_WARNING)
+                    st.button("📋 Copy Draft to Clipboard", key="copy_1")
                 
             else:
-                # Create tabs for multiple drafts
-                tab_names = [f"📄 Draft {i+1}" for i in range(num_drafts)]
-                tabs = st.tabs(tab_names)
-                
                 for i, tab in enumerate(tabs):
+                    if drafts[i] is None:
+                        continue
                     with tab:
-                        st.text_area(f"Reply Draft {i+1}:", drafts[i], height=300, key=f"draft_{i+1}")
+                        placeholders[i].text_area(f"Reply Draft {i+1}:", drafts[i], height=300, key=f"draft_{i+1}")
+                        if truncated[i]:
+                            st.warning(TRUNCATED_DRAFT_WARNING)
                         col_copy, col_edit = st.columns(2)
                         with col_copy:
                             st.button(f"📋 Copy Draft {i+1}", key=f"copy_{i+1}")
@@ -353,13 +637,13 @@ def main():
                             )
                             col_save, col_cancel = st.columns(2)
                             with col_save:
-                                if st.button(f"💾 Save Changes", key=f"save_{i+1}"):
+                                if st.button("💾 Save Changes", key=f"save_{i+1}"):
                                     drafts[i] = edited_draft
                                     st.session_state[f"edit_mode_{i+1}"] = False
                                     st.success("Changes saved!")
                                     st.rerun()
                             with col_cancel:
-                                if st.button(f"❌ Cancel", key=f"cancel_{i+1}"):
+                                if st.button("❌ Cancel", key=f"cancel_{i+1}"):
                                     st.session_state[f"edit_mode_{i+1}"] = False
                                     st.rerun()
             
@@ -370,14 +654,21 @@ def main():
             col_opt1, col_opt2, col_opt3 = st.columns(3)
             
             with col_opt1:
-                if st.button("🔄 Generate New Drafts"):
-                    st.rerun()
+                # This button is only drawn alongside drafts, so the click is handled
+                # in a callback, which runs even though the next run draws no drafts
+                st.button("🔄 Generate New Drafts", on_click=_request_new_drafts, args=(action_type,))
             
             with col_opt2:
                 # Download drafts
-                combined_drafts = f"Generated Email Replies - {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n"
+                buffer = io.StringIO()
+                buffer.write(f"Generated Email Replies - {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n")
                 for i, draft in enumerate(drafts):
-                    combined_drafts += f"=== DRAFT {i+1} ===\n{draft}\n\n"
+                    if draft is None:
+                        continue
+                    buffer.write(f"=== DRAFT {i+1} ===\n")
+                    buffer.write(draft)
+                    buffer.write("\n\n")
+                combined_drafts = buffer.getvalue()
                 
                 st.download_button(
                     "💾 Download All Drafts",
@@ -0,0 +1,400 @@
+# Gemini request machinery for email_assistant.py: shared resources, the response
+# cache, coalescing of identical in-flight requests, retries and streaming.
+#
+# Streamlit re-executes the app script as a fresh __main__ module on every run, so
+# classes and registries defined there are new objects each time. This module is
+# imported once per process, so every run and session shares the same ones.
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import diskcache
+import streamlit as st
+from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types
+
+CACHE_EXPIRE_SECONDS = 86400
+
+# These resources are often first needed on a worker or event-loop thread, which
+# has no ScriptRunContext to draw a spinner with
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """Shared Gemini client"""
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop():
+    """
+    Event loop running on its own thread for the life of the process. httpx
+    connection pools are bound to the loop they were first used on, so running
+    every async Gemini call here lets them all share one async client.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="gemini-event-loop", daemon=True).start()
+    return loop
+
+def get_async_client():
+    """Async side of the shared client; only use it on get_event_loop()"""
+    return get_client().aio
+
+# Background analyses run on a pool shared by every session. Each session has at
+# most one running (a superseded one is cancelled), and the threads mostly wait on
+# Gemini, so size it for the concurrent sessions one process should serve
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "32"))
+
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    """Worker pool for Gemini calls that should outlive the rerun that started them"""
+    return ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """
+    Responses are pure functions of model, prompt and config, so keep them on disk
+    across Streamlit reruns and restarts
+    """
+    return diskcache.Cache(".gemini_cache")
+
+def content_hash(text):
+    """
+    Short stable digest of a piece of text. These are cache keys, not security
+    hashes, so a 16-byte blake2b is plenty and cheaper than sha256.
+    """
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def _cache_key(model, prompt, config):
+    """Disk cache key for a Gemini request"""
+    config_json = config.model_dump_json(exclude_none=True) if config else ""
+    return content_hash(f"{model}|{config_json}|{prompt}").hex()
+
+# Exponential backoff for transient Gemini failures (5xx and rate limiting)
+RETRY_ATTEMPTS = 4
+RETRY_INITIAL_SECONDS = 0.5
+RETRY_MAX_SECONDS = 4.0
+RETRY_MULTIPLIER = 2.0
+
+def _is_transient(error):
+    """Whether a failed Gemini call is worth retrying"""
+    if isinstance(error, genai_errors.ServerError):
+        return True
+    return isinstance(error, genai_errors.ClientError) and error.code == 429
+
+def _retry_delays():
+    """Backoff delays between attempts"""
+    delay = RETRY_INITIAL_SECONDS
+    for _ in range(RETRY_ATTEMPTS - 1):
+        yield delay
+        delay = min(delay * RETRY_MULTIPLIER, RETRY_MAX_SECONDS)
+
+class SharedStream:
+    """
+    Accumulated text of a stream being produced elsewhere, which any number of
+    runs can follow. The future resolves to the final text, or to the error.
+    """
+    WAIT_SECONDS = 1.0
+
+    def __init__(self):
+        self.text = ""
+        self._changed = threading.Condition()
+        self.future = Future()
+        self.future.add_done_callback(lambda _: self._notify())
+
+    @classmethod
+    def finished(cls, text):
+        """A stream that has already completed with the given text"""
+        shared = cls()
+        shared.update(text)
+        shared.future.set_result(text)
+        return shared
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def update(self, text):
+        """Publish the latest accumulated text to followers"""
+        with self._changed:
+            self.text = text
+            self._changed.notify_all()
+
+    def _wait(self, shown):
+        """Wait (bounded) until the text differs from what a follower has shown, or the stream ends"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.text != shown or self.future.done(), self.WAIT_SECONDS)
+            return self.text
+
+    def follow(self):
+        """Yield the accumulated text whenever it changes, ending with the final text"""
+        shown = ""
+        while not self.future.done():
+            text = self._wait(shown)
+            if text != shown:
+                shown = text
+                yield shown
+        yield self.future.result()
+
+    async def afollow(self):
+        """Async variant of follow, for use alongside other streams"""
+        shown = ""
+        while not self.future.done():
+            text = await asyncio.to_thread(self._wait, shown)
+            if text != shown:
+                shown = text
+                yield shown
+        yield self.future.result()
+
+class BackgroundStream(SharedStream):
+    """
+    Drains a text stream on the shared worker pool, so it keeps running when
+    Streamlit interrupts the script for a rerun. The latest text can be followed
+    from any later run.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self._cancelled = threading.Event()
+        get_executor().submit(self._drain, stream)
+
+    def cancel(self):
+        """Stop draining at the next chunk, freeing the worker and any in-flight request"""
+        self._cancelled.set()
+
+    def _drain(self, stream):
+        try:
+            for text in stream:
+                if self._cancelled.is_set():
+                    break
+                self.update(text)
+        except Exception as e:
+            self.future.set_exception(e)
+            return
+        finally:
+            # Closing the generator releases its in-flight entry, so any other
+            # session following the same request takes over
+            stream.close()
+
+        if self._cancelled.is_set():
+            self.future.set_exception(AbandonedStream())
+        else:
+            self.future.set_result(self.text)
+
+class AbandonedStream(Exception):
+    """The run producing a shared response stopped before it finished"""
+
+class TruncatedResponse(Exception):
+    """The response stopped at max_output_tokens; text holds what was generated"""
+
+    def __init__(self, text):
+        super().__init__("The response was cut off at the output token limit")
+        self.text = text
+
+# Gemini requests currently streaming in any session, by cache key
+_inflight_requests = {}
+_inflight_lock = threading.Lock()
+
+def _join_inflight(key):
+    """
+    Coalesce identical concurrent requests: returns (shared, leading), where only
+    the leading caller talks to Gemini and everyone else follows its stream
+    """
+    with _inflight_lock:
+        if key in _inflight_requests:
+            return _inflight_requests[key], False
+        shared = _inflight_requests[key] = SharedStream()
+        return shared, True
+
+def _leave_inflight(key, shared):
+    """Unregister a leading request; followers of an unfinished one are told to retry"""
+    with _inflight_lock:
+        _inflight_requests.pop(key, None)
+    if not shared.future.done():
+        shared.future.set_exception(AbandonedStream())
+
+class _GeminiRequest:
+    """
+    Bookkeeping for one Gemini request that both transports share: the response
+    cache, coalescing with identical in-flight requests, retry backoff, and
+    publishing the streamed text to followers
+    """
+
+    def __init__(self, key, fallback, use_cache=True):
+        self.key = key
+        self.fallback = fallback
+        self.use_cache = use_cache
+        self.shared = None
+        self._delays = _retry_delays()
+
+    def claim(self):
+        """
+        True when this caller should call Gemini itself. Otherwise self.shared is
+        a stream to follow: a cached response or an identical in-flight request.
+        Without use_cache the cached response is skipped; the new one replaces it.
+        """
+        cached = get_response_cache().get(self.key) if self.use_cache else None
+        if cached is not None:
+            self.shared = SharedStream.finished(cached)
+            return False
+        self.shared, leading = _join_inflight(self.key)
+        return leading
+
+    def start_attempt(self):
+        self.shared.update("")
+
+    def append(self, text):
+        """Add a chunk and return the accumulated text"""
+        self.shared.update(self.shared.text + text)
+        return self.shared.text
+
+    def retry_delay(self, error):
+        """
+        Seconds to wait before retrying a failed attempt, or None when it must be
+        raised: not transient, retries exhausted, or text already shown
+        """
+        delay = next(self._delays, None)
+        if self.shared.text or delay is None or not _is_transient(error):
+            self.shared.future.set_exception(error)
+            return None
+        return delay
+
+    def finish(self, finish_reason):
+        """
+        Cache and publish the completed response; returns the fallback text when it
+        was empty. A response cut off by max_output_tokens is raised as
+        TruncatedResponse instead, and never cached.
+        """
+        text = self.shared.text
+        if not text:
+            self.shared.future.set_result(self.fallback)
+            return self.fallback
+        if finish_reason == types.FinishReason.MAX_TOKENS:
+            error = TruncatedResponse(text)
+            self.shared.future.set_exception(error)
+            raise error
+        get_response_cache().set(self.key, text, expire=CACHE_EXPIRE_SECONDS)
+        self.shared.future.set_result(text)
+        return None
+
+    def release(self):
+        _leave_inflight(self.key, self.shared)
+
+def stream_text(model, prompt, config, fallback, use_cache=True):
+    """
+    Stream a Gemini response, yielding the accumulated text after each chunk.
+    Transient failures are retried until the first chunk arrives; anything else,
+    including a TruncatedResponse, is raised and nothing is cached.
+    use_cache=False asks Gemini for a new response even when one is cached, e.g.
+    to regenerate sampled drafts.
+    """
+    request = _GeminiRequest(_cache_key(model, prompt, config), fallback, use_cache)
+    while not request.claim():
+        try:
+            yield from request.shared.follow()
+            return
+        except AbandonedStream:
+            continue
+
+    try:
+        while True:
+            request.start_attempt()
+            finish_reason = None
+            try:
+                for chunk in get_client().models.generate_content_stream(
+                    model=model,
+                    contents=prompt,
+                    config=config
+                ):
+                    if chunk.candidates and chunk.candidates[0].finish_reason:
+                        finish_reason = chunk.candidates[0].finish_reason
+                    if chunk.text:
+                        yield request.append(chunk.text)
+                break
+            except Exception as e:
+                delay = request.retry_delay(e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+        fallback_text = request.finish(finish_reason)
+        if fallback_text:
+            yield fallback_text
+    finally:
+        request.release()
+
+async def astream_text(model, prompt, config, fallback, use_cache=True):
+    """
+    Async variant of stream_text so several responses can stream concurrently.
+    Run it through run_streams, on the shared event loop.
+    """
+    request = _GeminiRequest(_cache_key(model, prompt, config), fallback, use_cache)
+    while not request.claim():
+        try:
+            async for text in request.shared.afollow():
+                yield text
+            return
+        except AbandonedStream:
+            continue
+
+    try:
+        while True:
+            request.start_attempt()
+            finish_reason = None
+            try:
+                async for chunk in await get_async_client().models.generate_content_stream(
+                    model=model,
+                    contents=prompt,
+                    config=config
+                ):
+                    if chunk.candidates and chunk.candidates[0].finish_reason:
+                        finish_reason = chunk.candidates[0].finish_reason
+                    if chunk.text:
+                        yield request.append(chunk.text)
+                break
+            except Exception as e:
+                delay = request.retry_delay(e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+        fallback_text = request.finish(finish_reason)
+        if fallback_text:
+            yield fallback_text
+    finally:
+        request.release()
+
+def run_streams(streams, on_text):
+    """
+    Consume several async text streams concurrently on the shared event loop.
+    on_text(index, text) is called from the calling thread, so it may draw
+    Streamlit elements. Returns the final text of each stream, or the exception
+    of one that failed.
+    """
+    updates = queue.SimpleQueue()
+
+    async def consume(index, stream):
+        text = ""
+        try:
+            async for text in stream:
+                updates.put((index, text))
+        except Exception as e:
+            return e
+        return text
+
+    async def consume_all():
+        try:
+            return await asyncio.gather(*[consume(i, s) for i, s in enumerate(streams)])
+        finally:
+            updates.put(None)
+
+    future = asyncio.run_coroutine_threadsafe(consume_all(), get_event_loop())
+    try:
+        for index, text in iter(updates.get, None):
+            on_text(index, text)
+        return future.result()
+    finally:
+        # Streamlit's rerun/stop signals raised by on_text abandon the streams
+        future.cancel()
@@ -0,0 +1,46 @@
+import runpy
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import diskcache
+import pytest
+from google.genai import types
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import gemini_requests
+
+SCRIPT = ROOT / "email_assistant.py"
+CHUNKS = ["Summary: ", "a meeting ", "request."]
+
+
+class FakeModels:
+    """Streams CHUNKS for every request, counting the calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.finish_reason = types.FinishReason.STOP
+
+    def generate_content_stream(self, model, contents, config=None):
+        self.calls += 1
+        for i, text in enumerate(CHUNKS):
+            # Like Gemini, only the last chunk carries the finish reason
+            finish_reason = self.finish_reason if i == len(CHUNKS) - 1 else None
+            yield SimpleNamespace(text=text, candidates=[SimpleNamespace(finish_reason=finish_reason)])
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch, tmp_path):
+    models = FakeModels()
+    monkeypatch.setattr(gemini_requests, "get_client", lambda: SimpleNamespace(models=models))
+    cache = diskcache.Cache(str(tmp_path / "responses"))
+    monkeypatch.setattr(gemini_requests, "get_response_cache", lambda: cache)
+    yield models
+    cache.close()
+
+
+def exec_script():
+    """A fresh copy of the app's namespace, as Streamlit creates on every run"""
+    return runpy.run_path(str(SCRIPT), run_name="email_assistant_run")
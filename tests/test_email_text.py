@@ -0,0 +1,129 @@
+import io
+import sys
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from email_assistant import extract_text_from_docx, extract_text_from_eml, strip_quoted_text
+
+
+def html_eml(html):
+    """An .eml upload with an HTML-only body"""
+    return io.BytesIO(
+        b"From: Vik <vik@example.com>\nSubject: Re: Meeting\nContent-Type: text/html; charset=utf-8\n\n"
+        + html.encode()
+    )
+
+
+def docx(body, doctype=""):
+    """A .docx upload whose word/document.xml has the given body"""
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8"?>{doctype}'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+        ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, "w") as archive:
+        archive.writestr("word/document.xml", document)
+    upload.seek(0)
+    return upload
+
+
+def test_signature_delimiter_cuts_signature():
+    email = "Can we meet on Tuesday?\n-- \nAnn\nSales"
+    assert strip_quoted_text(email) == "Can we meet on Tuesday?"
+
+
+def test_bare_dashes_are_kept():
+    email = "Hi team,\n\nAgenda:\n--\n1. budget\n2. hiring"
+    assert strip_quoted_text(email) == email
+
+
+def test_quoted_reply_history_is_dropped():
+    email = "Sounds good.\n> earlier line\n\nOn Mon, Oct 12, 2026 at 9:00 AM Ann wrote:\n> Can we meet?"
+    assert strip_quoted_text(email) == "Sounds good."
+
+
+def test_html_reply_drops_quoted_history():
+    eml = html_eml(
+        '<div dir="ltr">Sounds good, see you then.</div>'
+        '<div class="gmail_quote"><div class="gmail_attr">On Mon, Oct 12, 2026 at 9:00 AM Ann &lt;ann@example.com&gt; wrote:<br></div>'
+        '<blockquote class="gmail_quote">Can we meet?<blockquote>Earlier thread</blockquote></blockquote></div>'
+    )
+    text = extract_text_from_eml(eml)
+    assert text.endswith("\n\nSounds good, see you then.")
+
+
+def test_html_forward_keeps_forwarded_message():
+    eml = html_eml(
+        '<div dir="ltr">Can you answer this?</div>'
+        '<div class="gmail_quote"><div class="gmail_attr">---------- Forwarded message ---------<br>From: Ann</div>'
+        '<div>Can we meet on Tuesday?</div></div>'
+    )
+    assert "Can we meet on Tuesday?" in extract_text_from_eml(eml)
+
+
+def eml(content_type, body):
+    """An .eml upload with a single-part body of the given type"""
+    return io.BytesIO(b"From: Ann <ann@example.com>\nSubject: Launch\nContent-Type: " + content_type + b"\n\n" + body)
+
+
+def test_eml_body_is_decoded_with_its_declared_charset():
+    upload = eml(b"text/plain; charset=windows-1252", b"Caf\xe9 at 10? \x93Yes\x94")
+    assert extract_text_from_eml(upload).endswith("\n\nCaf\u00e9 at 10? \u201cYes\u201d")
+
+
+def test_eml_unknown_charset_falls_back_to_utf8():
+    upload = eml(b"text/plain; charset=x-no-such-charset", "Caf\u00e9 at 10?".encode("utf-8"))
+    assert extract_text_from_eml(upload).endswith("\n\nCaf\u00e9 at 10?")
+
+
+def test_eml_non_text_body_gives_empty_body():
+    upload = eml(b"application/pdf", b"%PDF-1.4")
+    assert extract_text_from_eml(upload) == "From: Ann <ann@example.com>\nSubject: Launch\nDate: No Date\n\n"
+
+
+def test_html_apple_mail_forward_keeps_forwarded_message():
+    eml = html_eml(
+        '<div>FYI, can you handle this?</div>'
+        '<div>Begin forwarded message:</div>'
+        '<blockquote type="cite"><div>From: Ann</div><div>Can we move the launch to Friday?</div></blockquote>'
+    )
+    assert "Can we move the launch to Friday?" in extract_text_from_eml(eml)
+
+
+def test_html_blockquote_only_body_is_kept():
+    eml = html_eml('<blockquote type="cite">Can we move the launch to Friday?</blockquote>')
+    assert extract_text_from_eml(eml).endswith("\n\nCan we move the launch to Friday?")
+
+
+def test_paragraph_break_around_quoted_line_is_kept():
+    assert strip_quoted_text("Para1\n\n> q\nPara2") == "Para1\n\nPara2"
+
+
+def test_docx_text_matches_python_docx_paragraphs():
+    upload = docx(
+        '<w:p><w:r><w:t>Name:</w:t><w:tab/><w:t>Vik</w:t></w:r></w:p>'
+        '<w:p><w:r><w:t>Line one</w:t><w:br/><w:t>Line two</w:t></w:r></w:p>'
+        '<w:p><w:r><w:t>Before page</w:t><w:br w:type="page"/><w:t>After page</w:t></w:r></w:p>'
+        '<w:p><w:r><w:t xml:space="preserve">See </w:t></w:r>'
+        '<w:hyperlink r:id="rId1"><w:r><w:t>the agenda</w:t></w:r></w:hyperlink></w:p>'
+        '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+        '<w:p/>'
+    )
+    # What "\n".join(p.text for p in docx.Document(upload).paragraphs) gives;
+    # table cells are not body paragraphs
+    assert extract_text_from_docx(upload) == "Name:\tVik\nLine one\nLine two\nBefore pageAfter page\nSee the agenda\n"
+
+
+def test_docx_external_entities_are_not_expanded(tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("TOP SECRET")
+    upload = docx(
+        '<w:p><w:r><w:t>Hello &xxe;</w:t></w:r></w:p>',
+        doctype=f'<!DOCTYPE w:document [<!ENTITY xxe SYSTEM "{secret.as_uri()}">]>'
+    )
+    assert "TOP SECRET" not in extract_text_from_docx(upload)
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+
+import gemini_requests
+from conftest import CHUNKS, FakeModels, exec_script
+
+
+class FakeAsyncModels(FakeModels):
+    """Async variant of FakeModels, recording the event loops it is called on"""
+
+    def __init__(self):
+        super().__init__()
+        self.loops = set()
+
+    async def generate_content_stream(self, model, contents, config=None):
+        self.loops.add(asyncio.get_running_loop())
+        chunks = super().generate_content_stream(model, contents, config)
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return stream()
+
+
+def test_use_cache_false_asks_gemini_again(fake_gemini):
+    run = exec_script()
+    first = run["generate_email_reply"]("Can we meet on Tuesday?", temperature=0.3)
+    assert run["generate_email_reply"]("Can we meet on Tuesday?", temperature=0.3) == first
+    assert fake_gemini.calls == 1
+
+    run["generate_email_reply"]("Can we meet on Tuesday?", temperature=0.3, use_cache=False)
+    assert fake_gemini.calls == 2
+
+
+def test_truncated_reply_is_raised_and_not_cached(fake_gemini):
+    run = exec_script()
+    fake_gemini.finish_reason = types.FinishReason.MAX_TOKENS
+    with pytest.raises(gemini_requests.TruncatedResponse) as truncated:
+        run["generate_email_reply"]("Can we meet on Tuesday?", custom_signature="Vik")
+    assert truncated.value.text == "".join(CHUNKS) + "\n\nVik"
+
+    fake_gemini.finish_reason = types.FinishReason.STOP
+    assert run["generate_email_reply"]("Can we meet on Tuesday?") == "".join(CHUNKS)
+    assert fake_gemini.calls == 2
+
+
+def test_async_requests_from_every_run_share_one_event_loop(fake_gemini, monkeypatch):
+    async_models = FakeAsyncModels()
+    client = SimpleNamespace(models=fake_gemini, aio=SimpleNamespace(models=async_models))
+    monkeypatch.setattr(gemini_requests, "get_client", lambda: client)
+
+    rendered_on = set()
+    for temperature in (0.3, 0.5):
+        run = exec_script()
+        stream = run["generate_email_reply_async"]("Can we meet on Tuesday?", temperature=temperature)
+        results = gemini_requests.run_streams([stream], lambda i, text: rendered_on.add(threading.current_thread()))
+        assert results == ["".join(CHUNKS)]
+
+    assert async_models.calls == 2
+    assert async_models.loops == {gemini_requests.get_event_loop()}
+    assert rendered_on == {threading.current_thread()}
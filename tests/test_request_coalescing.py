@@ -0,0 +1,37 @@
+import queue
+import threading
+
+from conftest import CHUNKS, exec_script
+
+
+def test_follower_in_another_run_takes_over_abandoned_request(fake_gemini):
+    leader_run, follower_run = exec_script(), exec_script()
+    assert leader_run["analyze_email"] is not follower_run["analyze_email"]
+
+    leader = leader_run["analyze_email"]("Can we meet on Tuesday?", stream=True)
+    assert next(leader) == CHUNKS[0]
+
+    seen = queue.Queue()
+    errors = []
+
+    def follow():
+        try:
+            for text in follower_run["analyze_email"]("Can we meet on Tuesday?", stream=True):
+                seen.put(text)
+        except BaseException as e:
+            errors.append(e)
+        seen.put(None)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    # The follower is attached once it has shown the leader's partial text
+    assert seen.get(timeout=5) == CHUNKS[0]
+
+    leader.close()
+    follower.join(timeout=5)
+
+    assert not follower.is_alive()
+    assert errors == []
+    texts = list(iter(seen.get_nowait, None))
+    assert texts[-1] == "".join(CHUNKS)
+    assert fake_gemini.calls == 2